@@ -0,0 +1,236 @@
+"""
+Measure the memory held by the loaded models and caches, and trace allocations around a prediction.
+"""
+
+import os
+import sys
+import tempfile
+import threading
+import tracemalloc
+import types
+
+import matplotlib.pyplot as plt
+import nltk
+import numpy as np
+from matplotlib._pylab_helpers import Gcf
+from nltk.corpus.util import LazyCorpusLoader
+
+from ComplaintsAnalysis.SentimentMetricGenerator import generate_sentiment_metric
+from ComplaintsAnalysis.TextPreprocess import pre_process_narrative
+
+# Shared objects reachable from everything, not owned by any model
+SKIPPED_TYPES = (type, types.ModuleType, types.FunctionType, types.BuiltinFunctionType, types.MethodType)
+
+# tracemalloc is process wide, so concurrent traces must not start, snapshot or stop it in between
+TRACE_LOCK = threading.Lock()
+
+
+def deep_sizeof(obj, seen=None):
+    """
+    Approximate the bytes held by obj and everything it references.
+    Each object is counted once, numpy arrays by their buffer.
+    Containers holding only str, like the millions of terms a vectorizer prunes, are sized
+    in one pass without tracking each string, so a string shared with another object counts twice.
+    :param obj:
+    :param seen: ids of objects already counted, shared between calls to skip them; updated in place
+    :return: size in bytes
+    """
+    if seen is None:
+        seen = set()
+    size = 0
+    stack = [obj]
+    while stack:
+        x = stack.pop()
+        if id(x) in seen or isinstance(x, SKIPPED_TYPES):
+            continue
+        seen.add(id(x))
+
+        if isinstance(x, np.ndarray):
+            # A view's getsizeof leaves out the buffer it shares
+            size += sys.getsizeof(x) if x.base is None else x.nbytes
+            if x.dtype == object:
+                stack.extend(x.ravel())
+            continue
+
+        size += sys.getsizeof(x)
+        if isinstance(x, dict):
+            stack.extend(x.keys())
+            stack.extend(x.values())
+        elif isinstance(x, (list, tuple, set, frozenset)):
+            if all(type(item) is str for item in x):
+                size += sum(map(sys.getsizeof, x))
+            else:
+                stack.extend(x)
+        elif isinstance(x, (str, bytes, int, float)):
+            continue
+        else:
+            if hasattr(x, "__dict__"):
+                stack.append(x.__dict__)
+            for slot in getattr(type(x), "__slots__", ()):
+                if hasattr(x, slot):
+                    stack.append(getattr(x, slot))
+    return size
+
+
+def format_size(num_bytes):
+    for unit in ["B", "KB", "MB"]:
+        if abs(num_bytes) < 1024:
+            return "{:.1f} {}".format(num_bytes, unit)
+        num_bytes /= 1024.0
+    return "{:.1f} GB".format(num_bytes)
+
+
+def get_tf_idf_parts(tf_idf_vectorizer):
+    """
+    Split a fitted tf-idf vectorizer into vocabulary, IDF weights and the terms
+    pruned by min_df/max_features, which are kept in stop_words_ but never used to transform.
+    """
+    tfidf_transformer = getattr(tf_idf_vectorizer, "_tfidf", None)
+    idf = getattr(tfidf_transformer, "_idf_diag", None)
+    if idf is None:
+        idf = getattr(tfidf_transformer, "idf_", None)
+
+    return {"tf_idf_vocabulary": getattr(tf_idf_vectorizer, "vocabulary_", None),
+            "tf_idf_idf": idf,
+            "tf_idf_pruned_terms": getattr(tf_idf_vectorizer, "stop_words_", None)}
+
+
+def get_classifier_parts(name, clf):
+    parts = {}
+    for attribute in ["coef_", "intercept_"]:
+        value = getattr(clf, attribute, None)
+        if value is not None:
+            parts[name + "_" + attribute.rstrip("_")] = value
+    return parts
+
+
+def measure_model(name, model, parts):
+    """
+    Measure each part of a model, then the rest of it, walking every object once.
+    :param parts: a dict from part name to an object held by model, None for parts not loaded
+    :return: a dict from part name to size in bytes, plus name_other and name_total
+    """
+    seen = set()
+    sizes = {}
+    for part_name, part in parts.items():
+        sizes[part_name] = None if part is None else deep_sizeof(part, seen)
+    sizes[name + "_other"] = deep_sizeof(model, seen)
+    sizes[name + "_total"] = sum(x for x in sizes.values() if x is not None)
+    return sizes
+
+
+def get_nltk_parts():
+    """
+    NLTK corpora are loaded lazily, so they only count once a prediction has used them.
+    """
+    parts = {}
+    for name in ["wordnet", "stopwords"]:
+        corpus = getattr(nltk.corpus, name)
+        parts["nltk_" + name] = None if isinstance(corpus, LazyCorpusLoader) else corpus
+    return parts
+
+
+def get_caches():
+    """
+    Pickled NLTK resources (e.g. punkt) loaded through nltk.data.load stay in nltk's resource cache.
+    Figures stay registered in pyplot until they are closed.
+    """
+    figures = [manager.canvas.figure for manager in Gcf.get_all_fig_managers()]
+    return {"nltk_resource_cache": getattr(nltk.data, "_resource_cache", {}),
+            "pyplot_open_figures": figures}
+
+
+def memory_report(clf_product, clf_escalation, tf_idf_vectorizer, scaler, stop_words):
+    """
+    Measure each loaded part of the predictor and the live caches.
+    :return: a dict from part name to size in bytes, None for parts not loaded
+    """
+    report = {"models": {}, "caches": {}}
+    report["models"].update(measure_model("tf_idf", tf_idf_vectorizer, get_tf_idf_parts(tf_idf_vectorizer)))
+    report["models"].update(measure_model("clf_product", clf_product,
+                                          get_classifier_parts("clf_product", clf_product)))
+    report["models"].update(measure_model("clf_escalation", clf_escalation,
+                                          get_classifier_parts("clf_escalation", clf_escalation)))
+
+    parts = {"scaler": scaler, "stop_words": stop_words}
+    parts.update(get_nltk_parts())
+    for name, part in parts.items():
+        report["models"][name] = None if part is None else deep_sizeof(part)
+    for name, cache in get_caches().items():
+        report["caches"][name] = {"entries": len(cache), "bytes": deep_sizeof(cache)}
+    return report
+
+
+def print_memory_report(report):
+    print("Memory footprint:")
+    for name, size in report["models"].items():
+        print("  {:<28} {}".format(name, "not loaded" if size is None else format_size(size)))
+    for name, cache in report["caches"].items():
+        print("  {:<28} {} ({} entries)".format(name, format_size(cache["bytes"]), cache["entries"]))
+
+
+def trace_allocations(func, *args, top_n=10):
+    """
+    Run func under tracemalloc and report the source lines that allocated the most memory.
+    Traces run one at a time; allocations made meanwhile by other threads still show up.
+    A tracer started by someone else keeps running and keeps its traces.
+    The peak is measured over func alone on Python 3.9+, which can reset it;
+    before that it also covers the first snapshot.
+    :param top_n: number of source lines to report
+    :return: result of func, and a dict of peak bytes above the start and the top allocation lines
+    """
+    with TRACE_LOCK:
+        was_tracing = tracemalloc.is_tracing()
+        if not was_tracing:
+            tracemalloc.start()
+
+        try:
+            before = tracemalloc.take_snapshot()
+            if hasattr(tracemalloc, "reset_peak"):
+                tracemalloc.reset_peak()
+            start, _ = tracemalloc.get_traced_memory()
+            result = func(*args)
+            _, peak = tracemalloc.get_traced_memory()
+            after = tracemalloc.take_snapshot()
+        finally:
+            if not was_tracing:
+                tracemalloc.stop()
+
+    exclude = [tracemalloc.Filter(False, tracemalloc.__file__)]
+    stats = after.filter_traces(exclude).compare_to(before.filter_traces(exclude), "lineno")
+    hot_spots = [{"location": "{}:{}".format(stat.traceback[0].filename, stat.traceback[0].lineno),
+                  "size_diff": stat.size_diff,
+                  "count_diff": stat.count_diff}
+                 for stat in stats[:top_n]]
+
+    return result, {"peak_bytes": peak - start, "hot_spots": hot_spots}
+
+
+def trace_prediction(predictor, narrative, top_n=10):
+    """
+    Trace allocations of the pre-processing steps and of a whole prediction.
+    The prediction draws its chart to a scratch file and closes it, so tracing leaves
+    the chart users see and pyplot's open figures as they were.
+    :return: a dict from step name to its trace
+    """
+    scratch_fd, scratch_fig = tempfile.mkstemp(suffix=".png")
+    os.close(scratch_fd)
+
+    def predict_without_side_effects(x):
+        open_figures = set(plt.get_fignums())
+        try:
+            return predictor.predict(x, scratch_fig)
+        finally:
+            for num in set(plt.get_fignums()) - open_figures:
+                plt.close(num)
+
+    traces = {}
+    _, traces["pre_process_narrative"] = trace_allocations(pre_process_narrative, narrative,
+                                                           predictor.stop_words, top_n=top_n)
+    _, traces["generate_sentiment_metric"] = trace_allocations(generate_sentiment_metric, [narrative],
+                                                               top_n=top_n)
+    try:
+        _, traces["predict"] = trace_allocations(predict_without_side_effects, narrative, top_n=top_n)
+    finally:
+        os.remove(scratch_fig)
+    return traces
@@ -0,0 +1,323 @@
+"""
+Training and evaluation driver for the product and escalation classifiers.
+
+Features are built once and cached, then the cross-validation folds of every
+hyperparameter candidate of both classifiers run in parallel across cores.
+The best candidates are refitted, evaluated on a held-out set with per-class
+ROC/AUC, and saved with the scaler, the tf-idf vectorizer the features came
+from, the stop words and the response names as a bundle in the file names
+Predictor loads from its model directory.
+
+Run from the repository root:
+    python -m ComplaintsAnalysis.ModelSelection --n-jobs -1
+"""
+
+import argparse
+import ast
+import json
+import os
+import shutil
+from itertools import product
+
+import numpy as np
+import pandas as pd
+from joblib import Parallel, delayed
+from scipy.sparse import csr_matrix, hstack
+from sklearn.linear_model import LogisticRegression
+from sklearn.metrics import auc, roc_curve
+from sklearn.model_selection import StratifiedKFold, train_test_split
+from sklearn.preprocessing import label_binarize
+
+from ComplaintsAnalysis.SentimentMetricGenerator import transfer_label_column
+from ComplaintsAnalysis.Utilities import (PRODUCT_LABELS, VALIDATION_SIZE, chop_response_type, draw_roc_curve,
+                                          get_response_types, load_model, save_model, scale_features)
+
+DATA_DIR = "ComplaintsAnalysis/data"
+MODEL_DIR = "ComplaintsAnalysis/trained_models"
+
+SENTIMENT_COLUMNS = ["corpus_score_sum", "corpus_score_ave", "negative_ratio", "most_negative_score",
+                     "word_num", "sentence_num", "num_of_question_mark", "num_of_exclaimation_mark"]
+
+# Bundle file names, as Predictor and get_response_types load them
+MODEL_FILES = {"product": "product_classifier_lgreg.sav", "escalation": "lgreg.all.joblib"}
+TF_IDF_VECTORIZER_FILE = "tfidf_vectorizer_max50000.all.joblib"
+STOP_WORDS_FILE = "STOP_WORDs.txt"
+RESPONSE_NAMES_FILE = "company_corresponse_variable_names.csv"
+
+PARAM_GRID = {"C": [0.1, 0.3, 1.0, 3.0, 10.0],
+              "class_weight": [None, "balanced"]}
+
+
+def build_features(complaints_file, narrative_file, tf_idf_vectorizer_file):
+    """
+    Join the complaints carrying sentiment metrics with their pre-processed narratives
+    and turn them into the feature layout Predictor uses.
+    :param complaints_file: output of SentimentMetricGenerator, complaints with sentiment metrics
+    :param narrative_file: output of TextPreprocess, complaints with processed_narrative
+    :param tf_idf_vectorizer_file: pre-trained tf-idf vectorizer
+    :return: a dict of tf-idf matrix, metric dataframe, product labels and escalation labels
+    """
+    complaints = pd.read_csv(complaints_file)
+    narratives = pd.read_csv(narrative_file).loc[:, ["Complaint ID", "processed_narrative"]]
+    complaints = pd.merge(complaints, narratives, how="inner", on="Complaint ID")
+
+    # processed_narrative is stored as the string of a token list
+    texts = [" ".join(ast.literal_eval(x)) for x in complaints["processed_narrative"]]
+    tf_idf_vectorizer = load_model(tf_idf_vectorizer_file)
+    narratives_vectorized = csr_matrix(tf_idf_vectorizer.transform(texts))
+
+    # Same company response dummy columns, in the same order, as Predictor.predict_escalation
+    metrics = complaints.loc[:, SENTIMENT_COLUMNS].reset_index(drop=True)
+    chopped_responses = complaints["Company response to consumer"].apply(chop_response_type).values
+    for response in get_response_types():
+        metrics["company_response_" + response] = (chopped_responses == response).astype(int)
+
+    # Product classifier output index maps into PRODUCT_LABELS, -1 for products not listed
+    product_labels = np.array([PRODUCT_LABELS.index(x) if x in PRODUCT_LABELS else -1
+                               for x in complaints["Product"]])
+    escalation_labels = transfer_label_column(complaints["Consumer disputed?"]).values
+
+    return {"narratives_vectorized": narratives_vectorized,
+            "metrics": metrics,
+            "product_labels": product_labels,
+            "escalation_labels": escalation_labels}
+
+
+def get_input_stamps(input_files):
+    return {os.path.abspath(x): os.path.getmtime(x) for x in input_files}
+
+
+def load_features(complaints_file, narrative_file, tf_idf_vectorizer_file, cache_file):
+    """
+    Load features from cache_file, building and caching them first if needed.
+    The cache is rebuilt when the input files differ from, or are newer than, the ones it was built from.
+    """
+    input_stamps = get_input_stamps([complaints_file, narrative_file, tf_idf_vectorizer_file])
+    if os.path.exists(cache_file):
+        features = load_model(cache_file)
+        if features.get("input_stamps") == input_stamps:
+            print("Loading cached features from " + cache_file)
+            return features
+        print("Cached features in " + cache_file + " were built from other inputs")
+
+    print("Building features...")
+    features = build_features(complaints_file, narrative_file, tf_idf_vectorizer_file)
+    features["input_stamps"] = input_stamps
+    save_model(features, cache_file)
+    print("Features cached to " + cache_file)
+    return features
+
+
+def get_design_matrices(task, features, train_index, test_index, scaler_file=None):
+    """
+    Slice the train and test design matrices of a task.
+    The escalation task scales word_num and sentence_num on the training part only.
+    :param task: "product" or "escalation"
+    :param scaler_file: where scale_features saves the scaler, None to skip saving
+    :return: X_train, X_test
+    """
+    narratives_vectorized = features["narratives_vectorized"]
+    if task == "product":
+        return narratives_vectorized[train_index], narratives_vectorized[test_index]
+
+    metrics_train = features["metrics"].iloc[train_index].copy()
+    metrics_test = features["metrics"].iloc[test_index].copy()
+    metrics_train, metrics_test = scale_features(metrics_train, metrics_test, scaler_file)
+
+    X_train = hstack((narratives_vectorized[train_index], np.array(metrics_train))).tocsr()
+    X_test = hstack((narratives_vectorized[test_index], np.array(metrics_test))).tocsr()
+    return X_train, X_test
+
+
+def make_classifier(params):
+    # One job per model, the parallelism is across folds and candidates
+    return LogisticRegression(solver="liblinear", n_jobs=1, **params)
+
+
+def compute_roc(y_true, y_score, classes):
+    """
+    Compute the ROC curve of each class, plus the micro-average when there are more than two classes.
+    :param y_score: predict_proba output, one column per class
+    :param classes: the classifier classes_, matching the columns of y_score
+    :return: fpr, tpr, roc_auc dicts keyed by column index (and "micro")
+    """
+    fpr, tpr, roc_auc = {}, {}, {}
+    if len(classes) == 2:
+        fpr[0], tpr[0], _ = roc_curve(y_true, y_score[:, 1])
+        roc_auc[0] = auc(fpr[0], tpr[0])
+        return fpr, tpr, roc_auc
+
+    y_true_binarized = label_binarize(y_true, classes=classes)
+    for i in range(len(classes)):
+        # AUC is undefined for a class without positive or negative samples
+        if 0 < np.sum(y_true_binarized[:, i]) < len(y_true):
+            fpr[i], tpr[i], _ = roc_curve(y_true_binarized[:, i], y_score[:, i])
+            roc_auc[i] = auc(fpr[i], tpr[i])
+
+    fpr["micro"], tpr["micro"], _ = roc_curve(y_true_binarized.ravel(), y_score.ravel())
+    roc_auc["micro"] = auc(fpr["micro"], tpr["micro"])
+    return fpr, tpr, roc_auc
+
+
+def macro_auc(roc_auc):
+    return float(np.mean([value for key, value in roc_auc.items() if key != "micro"]))
+
+
+def evaluate_fold(task, params, features, labels, train_index, test_index):
+    """
+    Fit one candidate on one fold and return its (macro) AUC on the fold's test part.
+    """
+    X_train, X_test = get_design_matrices(task, features, train_index, test_index)
+    clf = make_classifier(params)
+    clf.fit(X_train, labels[train_index])
+    _, _, roc_auc = compute_roc(labels[test_index], clf.predict_proba(X_test), clf.classes_)
+    return macro_auc(roc_auc)
+
+
+def get_candidates(param_grid):
+    names = sorted(param_grid.keys())
+    return [dict(zip(names, values)) for values in product(*[param_grid[name] for name in names])]
+
+
+def select_models(features, splits, candidates, n_folds, n_jobs):
+    """
+    Cross-validate every candidate of both classifiers in one parallel batch.
+    :param splits: {task: (labels, train_index)} restricted to the training part
+    :return: {task: list of {"params", "mean_auc", "std_auc"}} sorted best first
+    """
+    jobs = []
+    for task, (labels, train_index) in splits.items():
+        folds = StratifiedKFold(n_splits=n_folds, shuffle=True, random_state=0)
+        for fold_train, fold_test in folds.split(train_index, labels[train_index]):
+            for candidate_index, params in enumerate(candidates):
+                jobs.append((task, candidate_index, params, train_index[fold_train], train_index[fold_test]))
+
+    print("Running {} fits on {} jobs...".format(len(jobs), n_jobs))
+    scores = Parallel(n_jobs=n_jobs, verbose=5)(
+        delayed(evaluate_fold)(task, params, features, splits[task][0], fold_train, fold_test)
+        for task, _, params, fold_train, fold_test in jobs)
+
+    results = {}
+    for task in splits:
+        task_results = []
+        for candidate_index, params in enumerate(candidates):
+            fold_scores = [score for job, score in zip(jobs, scores)
+                           if job[0] == task and job[1] == candidate_index]
+            task_results.append({"params": params,
+                                 "mean_auc": float(np.mean(fold_scores)),
+                                 "std_auc": float(np.std(fold_scores))})
+        results[task] = sorted(task_results, key=lambda x: x["mean_auc"], reverse=True)
+    return results
+
+
+def fit_and_report(task, params, features, labels, train_index, test_index, output_dir):
+    """
+    Refit the best candidate on the training part, draw the ROC curves on the held-out part.
+    :return: the fitted classifier and the held-out AUC of each class
+    """
+    scaler_file = output_dir + "/scaler.joblib" if task == "escalation" else None
+    X_train, X_test = get_design_matrices(task, features, train_index, test_index, scaler_file)
+    clf = make_classifier(params)
+    clf.fit(X_train, labels[train_index])
+
+    fpr, tpr, roc_auc = compute_roc(labels[test_index], clf.predict_proba(X_test), clf.classes_)
+    if task == "product":
+        keys = [i for i in range(len(clf.classes_)) if i in roc_auc]
+        label_names = [PRODUCT_LABELS[clf.classes_[i]] for i in keys]
+    else:
+        keys = [0]
+        label_names = ["Escalation"]
+
+    # draw_roc_curve indexes the curves by position, with the micro-average under "micro"
+    fpr_list, tpr_list, roc_auc_list = [{j: x[i] for j, i in enumerate(keys)} for x in [fpr, tpr, roc_auc]]
+    draw_micro = "micro" in roc_auc
+    if draw_micro:
+        fpr_list["micro"], tpr_list["micro"], roc_auc_list["micro"] = fpr["micro"], tpr["micro"], roc_auc["micro"]
+    draw_roc_curve("ROC of {} classifier".format(task), output_dir + "/roc_{}.png".format(task),
+                   fpr_list, tpr_list, roc_auc_list, label_names, draw_micro=draw_micro)
+
+    auc_report = {name: float(roc_auc[i]) for name, i in zip(label_names, keys)}
+    if "micro" in roc_auc:
+        auc_report["micro"] = float(roc_auc["micro"])
+    return clf, auc_report
+
+
+def check_product_classes(classes):
+    """
+    Predictor maps the predict_proba column index straight into PRODUCT_LABELS,
+    so the product classifier must know every product, in PRODUCT_LABELS order.
+    """
+    missing = sorted(set(range(len(PRODUCT_LABELS))) - set(classes))
+    if list(classes) != list(range(len(PRODUCT_LABELS))):
+        raise ValueError("Product classifier needs every product in PRODUCT_LABELS, missing: {}".format(
+            [PRODUCT_LABELS[i] for i in missing]))
+
+
+def copy_bundle_inputs(tf_idf_vectorizer_file, output_dir):
+    """
+    Copy the files the classifiers depend on next to them, so the bundle loads as a whole.
+    :param tf_idf_vectorizer_file: the vectorizer the features were built with
+    """
+    shutil.copy(tf_idf_vectorizer_file, output_dir + "/" + TF_IDF_VECTORIZER_FILE)
+    for file_name in [STOP_WORDS_FILE, RESPONSE_NAMES_FILE]:
+        shutil.copy(MODEL_DIR + "/" + file_name, output_dir + "/" + file_name)
+
+
+def run_model_selection(features, tf_idf_vectorizer_file, output_dir, param_grid=PARAM_GRID, n_folds=5,
+                        n_jobs=-1):
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+
+    # Hold out the same number of complaints for both classifiers as the original evaluation
+    splits, held_out = {}, {}
+    for task in ["product", "escalation"]:
+        labels = features[task + "_labels"]
+        labeled_index = np.where(labels >= 0)[0]
+        train_index, test_index = train_test_split(labeled_index, test_size=VALIDATION_SIZE,
+                                                   stratify=labels[labeled_index], random_state=0)
+        splits[task] = (labels, train_index)
+        held_out[task] = test_index
+
+    # Fail before the sweep rather than after it
+    check_product_classes(np.unique(features["product_labels"][splits["product"][1]]))
+
+    cv_results = select_models(features, splits, get_candidates(param_grid), n_folds, n_jobs)
+
+    # Record which inputs, including the vectorizer, the features came from
+    report = {"inputs": features.get("input_stamps")}
+    for task, (labels, train_index) in splits.items():
+        best_params = cv_results[task][0]["params"]
+        print("Best {} classifier: {} (cv auc {:.3f})".format(task, best_params, cv_results[task][0]["mean_auc"]))
+        clf, auc_report = fit_and_report(task, best_params, features, labels, train_index, held_out[task],
+                                         output_dir)
+        if task == "product":
+            check_product_classes(clf.classes_)
+        save_model(clf, output_dir + "/" + MODEL_FILES[task])
+        report[task] = {"best_params": best_params, "held_out_auc": auc_report, "cv_results": cv_results[task]}
+
+    copy_bundle_inputs(tf_idf_vectorizer_file, output_dir)
+
+    with open(output_dir + "/model_selection_report.json", "w") as fobj:
+        json.dump(report, fobj, indent=2)
+    print("Model bundle and report saved to " + output_dir)
+
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Select and evaluate the product and escalation classifiers.")
+    parser.add_argument("--complaints", default=DATA_DIR + "/complaints_with_sentiment_metric.csv")
+    parser.add_argument("--narratives", default=DATA_DIR + "/narrative_preprocessed.csv")
+    parser.add_argument("--vectorizer", default=MODEL_DIR + "/" + TF_IDF_VECTORIZER_FILE)
+    parser.add_argument("--cache", default=DATA_DIR + "/features.cache.joblib")
+    parser.add_argument("--output-dir", default=MODEL_DIR + "/selected")
+    parser.add_argument("--folds", type=int, default=5)
+    parser.add_argument("--n-jobs", type=int, default=-1, help="parallel jobs, -1 for all cores")
+    args = parser.parse_args()
+
+    features = load_features(args.complaints, args.narratives, args.vectorizer, args.cache)
+    run_model_selection(features, args.vectorizer, args.output_dir, n_folds=args.folds, n_jobs=args.n_jobs)
+
+
+if __name__ == "__main__":
+    main()
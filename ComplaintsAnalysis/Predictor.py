@@ -5,6 +5,7 @@ import matplotlib.pyplot as plt
 
 from scipy.sparse import hstack
 
+from ComplaintsAnalysis.MemoryProfile import memory_report, print_memory_report, trace_prediction
 from ComplaintsAnalysis.SentimentMetricGenerator import generate_sentiment_metric
 from ComplaintsAnalysis.TextPreprocess import pre_process_narrative
 from ComplaintsAnalysis.Utilities import load_models, get_response_types, PRODUCT_LABELS
@@ -24,8 +25,26 @@ class Predictor:
                                                                              tf_idf_vectorizer_file,
                                                                              scaler_file,
                                                                              stop_words_file)
+        print_memory_report(self.memory_report())
 
-    def predict(self, narrative):
+    def memory_report(self):
+        """
+        Measure the memory held by each loaded model part and the live caches.
+        :return: a dict with the bytes of each model part and the size of each cache
+        """
+        return memory_report(self.clf_product, self.clf_escalation, self.tf_idf_vectorizer, self.scaler,
+                             self.stop_words)
+
+    def trace_prediction(self, narrative, top_n=10):
+        """
+        Trace memory allocations of pre_process_narrative, generate_sentiment_metric and predict
+        :param narrative:
+        :param top_n: number of allocation hot spots to report per step
+        :return: a dict from step name to its peak memory and hot spots
+        """
+        return trace_prediction(self, narrative, top_n)
+
+    def predict(self, narrative, escalation_prob_fig="static/escalation_prob.png"):
         """
         Given a narrative,
         1. predict the product category
@@ -35,6 +54,7 @@ class Predictor:
         :param narrative:
         :param clf_product: pre-trained product classifier
         :param clf_escalation: pre-trained escalation classifier
+        :param escalation_prob_fig: file the bar chart is saved to
         :return: product category, bar chart, the suggest response type
         """
         sentiment_metric = generate_sentiment_metric([narrative])
@@ -55,7 +75,8 @@ class Predictor:
 
         # Predict the probabilities of escalation when adopting
         escalation_prob_fig, response, escalation_probas_according_response = self.predict_escalation(narrative_vectorized,
-                                                                                                      sentiment_metric)
+                                                                                                      sentiment_metric,
+                                                                                                      escalation_prob_fig)
 
         response = response.split("_")[-1]
         response = re.sub(r"Closed with ", "", response).capitalize()
@@ -72,7 +93,8 @@ class Predictor:
 
         return product_type
 
-    def predict_escalation(self, narrative_vectorized, sentiment_metric):
+    def predict_escalation(self, narrative_vectorized, sentiment_metric,
+                           escalation_prob_fig="static/escalation_prob.png"):
         # Predict probability of dispute according to all different responses
         response_types = get_response_types()
         predict_probability_list = []
@@ -104,7 +126,6 @@ class Predictor:
             predict_probability_list.append(predict_probability)
 
         # Draw bar chart of escalation probability under different responses
-        escalation_prob_fig = "static/escalation_prob.png"
 
         data = pd.DataFrame()
         data["Company Response"] = response_types
@@ -1,3 +1,5 @@
+from itertools import cycle
+
 from joblib import dump, load
 import matplotlib.pyplot as plt
 import re
@@ -29,11 +31,17 @@ def load_model(saved_model_file):
     return temp_model
 
 
-def scale_features(X_train, X_test):
+def scale_features(X_train, X_test, scaler_file="trained_models/scaler.joblib"):
+    """
+    Scale word_num and sentence_num to [0, 1] using a scaler fitted on X_train.
+    :param scaler_file: where to save the fitted scaler, None to skip saving
+    :return: scaled X_train, X_test
+    """
     scaler = MinMaxScaler()
     scaler.fit(X_train.loc[:, ["word_num", "sentence_num"]])
 
-    save_model(scaler, "trained_models/scaler.joblib")
+    if scaler_file is not None:
+        save_model(scaler, scaler_file)
 
     X_train.loc[:, ["word_num", "sentence_num"]] = scaler.transform(X_train.loc[:, ["word_num", "sentence_num"]])
     X_test.loc[:, ["word_num", "sentence_num"]] = scaler.transform(X_test.loc[:, ["word_num", "sentence_num"]])
@@ -41,6 +49,14 @@ def scale_features(X_train, X_test):
     return X_train, X_test
 
 
+def chop_response_type(response):
+    """
+    Shorten a company response, e.g. "company_response_Closed with explanation" to "Explanation"
+    """
+    response = response.split("_")[-1]
+    return re.sub(r"Closed with ", "", response).capitalize()
+
+
 def get_response_types():
     response_column_names_file = "ComplaintsAnalysis/trained_models/company_corresponse_variable_names.csv"
 
@@ -49,9 +65,7 @@ def get_response_types():
         response_types = line.rstrip().split(",")
         chopped_response_types = []
         for response in response_types:
-            response = response.split("_")[-1]
-            response = re.sub(r"Closed with ", "", response).capitalize()
-            chopped_response_types.append(response)
+            chopped_response_types.append(chop_response_type(response))
 
     return chopped_response_types
 
@@ -93,7 +107,8 @@ def draw_roc_curve(title, save_file, fpr_list, tpr_list, roc_auc_list, label_nam
     colors = prop_cycle.by_key()['color']
     lw = 2 # line width
 
-    for i, color in zip(range(n_classes), colors):
+    # Reuse colors when there are more curves than colors in the cycle
+    for i, color in zip(range(n_classes), cycle(colors)):
         plt.plot(fpr_list[i], tpr_list[i], color=color, lw = lw,
                  label='{0} (area = {1:0.2f})'
                        ''.format(label_name_list[i], roc_auc_list[i]))
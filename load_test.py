@@ -0,0 +1,282 @@
+"""
+Load-testing harness for the Complaint Assistant Flask service.
+
+Starts the app locally with a given command (Flask dev server by default, or any
+WSGI server such as "gunicorn -w 4 --threads 2 server:app"), replays a corpus of
+narratives against /predict at a configurable concurrency and request rate, and
+reports throughput, p50/p95/p99 latency and error rate broken down by status.
+
+/predict carries the whole narrative in the query string, so a WSGI server with a
+request line limit (gunicorn defaults to 4094 bytes) answers long narratives with 400.
+Lift the limit when comparing servers, otherwise the comparison measures corpus length.
+
+Example:
+    python load_test.py --corpus data/complaints-2019-05-16_13_17.clean.csv \
+        --concurrency 8 --rate 20 --requests 400 \
+        --server-cmd "gunicorn -w 4 --threads 2 --limit-request-line 0 -b 127.0.0.1:5000 server:app" \
+        --tag gunicorn_w4_t2
+"""
+
+import argparse
+import json
+import os
+import shlex
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import requests
+
+NARRATIVE_COLUMN = "Consumer complaint narrative"
+DEFAULT_SERVER_CMD = sys.executable + " server.py"
+DEFAULT_URL = "http://127.0.0.1:5000"
+RESULT_DIR = "load_test_results"
+
+
+def load_corpus(corpus_file):
+    """
+    Load narratives to replay. A csv file must contain the column
+    "Consumer complaint narrative"; any other file is read as one narrative per line.
+    :param corpus_file:
+    :return: a list of non-empty narratives
+    """
+    if corpus_file.endswith(".csv"):
+        narratives = pd.read_csv(corpus_file)[NARRATIVE_COLUMN].dropna().tolist()
+    else:
+        with open(corpus_file, "r") as fobj:
+            narratives = [line.rstrip("\n") for line in fobj]
+
+    narratives = [x for x in narratives if x.strip() != ""]
+    if len(narratives) == 0:
+        raise ValueError("No narrative found in " + corpus_file)
+    return narratives
+
+
+def start_server(server_cmd, url, startup_timeout, log_file):
+    """
+    Launch the app and wait until the home page answers.
+    Loading the models can take a while, so poll until startup_timeout.
+    :param server_cmd: command line starting the app from the repository root
+    :param url: base url the app listens on
+    :param startup_timeout: seconds to wait before giving up
+    :param log_file: file collecting the server's stdout and stderr
+    :return: the server process
+    """
+    print("Starting server: " + server_cmd)
+    print("Server log: " + log_file)
+    with open(log_file, "w") as log:
+        process = subprocess.Popen(shlex.split(server_cmd),
+                                   cwd=os.path.dirname(os.path.abspath(__file__)),
+                                   stdout=log,
+                                   stderr=subprocess.STDOUT)
+
+    deadline = time.time() + startup_timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError("Server exited with code {} during startup, see {}".format(process.returncode,
+                                                                                             log_file))
+        try:
+            requests.get(url + "/", timeout=1)
+            print("Server is ready")
+            return process
+        except requests.exceptions.RequestException:
+            time.sleep(0.5)
+
+    stop_server(process)
+    raise RuntimeError("Server did not answer within {} seconds, see {}".format(startup_timeout, log_file))
+
+
+def stop_server(process):
+    process.terminate()
+    try:
+        process.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+
+def send_request(url, narrative, timeout, start=None):
+    """
+    Send one prediction request.
+    :param start: perf_counter time the request was scheduled at, now when None.
+        Timing from the schedule counts the time a late request waited for a free worker.
+    :return: (latency in seconds, status), status is the HTTP status code,
+        or the exception class name when no response came back
+    """
+    if start is None:
+        start = time.perf_counter()
+    try:
+        response = requests.get(url + "/predict", params={"user_input": narrative}, timeout=timeout)
+        status = str(response.status_code)
+    except requests.exceptions.RequestException as e:
+        status = type(e).__name__
+    return time.perf_counter() - start, status
+
+
+def run_load(url, narratives, num_requests, concurrency, rate, timeout):
+    """
+    Replay narratives round robin against the service.
+    :param num_requests: total number of requests to send
+    :param concurrency: number of requests allowed in flight at once
+    :param rate: target requests per second over all workers, 0 means as fast as possible
+    :return: list of latencies, list of statuses, wall clock seconds
+    """
+    interval = 1.0 / rate if rate > 0 else 0
+    lock = threading.Lock()
+    next_slot = [time.perf_counter()]
+
+    def paced_request(narrative):
+        # Reserve the next send slot so the whole pool follows the target rate
+        if interval > 0:
+            with lock:
+                slot = next_slot[0]
+                next_slot[0] = slot + interval
+            delay = slot - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            return send_request(url, narrative, timeout, start=slot)
+        return send_request(url, narrative, timeout)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = [executor.submit(paced_request, narratives[i % len(narratives)])
+                   for i in range(num_requests)]
+        results = [future.result() for future in futures]
+    elapsed = time.perf_counter() - start
+
+    latencies = [x[0] for x in results]
+    statuses = [x[1] for x in results]
+    return latencies, statuses, elapsed
+
+
+def summarize(latencies, statuses, elapsed):
+    """
+    Compute throughput, latency percentiles (over successful requests), error rate
+    and the number of errors per status.
+    """
+    ok_latencies = np.array([latency for latency, status in zip(latencies, statuses) if status == "200"])
+    error_breakdown = pd.Series([x for x in statuses if x != "200"]).value_counts()
+    num_errors = int(error_breakdown.sum())
+
+    summary = {
+        "requests": len(statuses),
+        "errors": num_errors,
+        "error_rate": num_errors / len(statuses),
+        "error_breakdown": {str(status): int(count) for status, count in error_breakdown.items()},
+        "elapsed_s": elapsed,
+        "throughput_rps": len(statuses) / elapsed,
+    }
+    for percentile in [50, 95, 99]:
+        key = "p{}_ms".format(percentile)
+        summary[key] = float(np.percentile(ok_latencies, percentile) * 1000) if len(ok_latencies) > 0 else None
+    return summary
+
+
+def get_base_name(tag):
+    """
+    Prefix shared by the result and server log files of one run.
+    """
+    if not os.path.exists(RESULT_DIR):
+        os.makedirs(RESULT_DIR)
+
+    stamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    return RESULT_DIR + "/" + "{}.{}".format(tag, stamp)
+
+
+def save_results(summary, settings, latencies, statuses, tag, base_name):
+    """
+    Save the summary with run settings as json, and the raw latencies as csv,
+    so runs with different deployment settings can be compared.
+    """
+    with open(base_name + ".json", "w") as fobj:
+        json.dump({"tag": tag, "settings": settings, "summary": summary}, fobj, indent=2)
+
+    raw = pd.DataFrame()
+    raw["latency_s"] = latencies
+    raw["status"] = statuses
+    raw["ok"] = [x == "200" for x in statuses]
+    raw.to_csv(base_name + ".csv", index=False)
+
+    print("Results saved to " + base_name + ".json")
+
+
+def print_summary(summary):
+    print("Requests:    {}".format(summary["requests"]))
+    print("Errors:      {} ({:.2%})".format(summary["errors"], summary["error_rate"]))
+    for status, count in summary["error_breakdown"].items():
+        print("  {:<10} {}".format(status, count))
+    print("Throughput:  {:.2f} req/s".format(summary["throughput_rps"]))
+    for key in ["p50_ms", "p95_ms", "p99_ms"]:
+        value = summary[key]
+        print("{:<12} {}".format(key[:3] + ":", "n/a" if value is None else "{:.1f} ms".format(value)))
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Replay complaint narratives against the Flask service.")
+    parser.add_argument("--corpus", required=True,
+                        help="csv with a '{}' column, or text file with one narrative per line".format(NARRATIVE_COLUMN))
+    parser.add_argument("--requests", type=int, default=200, help="total number of requests")
+    parser.add_argument("--concurrency", type=int, default=4, help="requests in flight at once")
+    parser.add_argument("--rate", type=float, default=0, help="target requests per second, 0 for unlimited")
+    parser.add_argument("--timeout", type=float, default=60, help="per request timeout in seconds")
+    parser.add_argument("--url", default=DEFAULT_URL, help="base url of the service")
+    parser.add_argument("--server-cmd", default=DEFAULT_SERVER_CMD,
+                        help="command starting the app, "
+                             "e.g. 'gunicorn -w 4 --threads 2 --limit-request-line 0 server:app'")
+    parser.add_argument("--no-server", action="store_true", help="test an already running service")
+    parser.add_argument("--startup-timeout", type=float, default=120, help="seconds to wait for the app to start")
+    parser.add_argument("--warmup", type=int, default=5, help="requests sent before measuring")
+    parser.add_argument("--tag", default="flask_dev", help="name of this deployment setting in the result files")
+    args = parser.parse_args(argv)
+
+    if args.requests <= 0:
+        parser.error("--requests must be positive")
+    if args.concurrency <= 0:
+        parser.error("--concurrency must be positive")
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    narratives = load_corpus(args.corpus)
+    print("Loaded {} narratives".format(len(narratives)))
+
+    base_name = get_base_name(args.tag)
+    process = None
+    if not args.no_server:
+        process = start_server(args.server_cmd, args.url, args.startup_timeout, base_name + ".server.log")
+
+    try:
+        for i in range(args.warmup):
+            send_request(args.url, narratives[i % len(narratives)], args.timeout)
+
+        print("Sending {} requests, concurrency {}, rate {}".format(
+            args.requests, args.concurrency, args.rate if args.rate > 0 else "unlimited"))
+        latencies, statuses, elapsed = run_load(args.url, narratives, args.requests,
+                                                 args.concurrency, args.rate, args.timeout)
+    finally:
+        if process is not None:
+            stop_server(process)
+
+    summary = summarize(latencies, statuses, elapsed)
+    print_summary(summary)
+
+    settings = {
+        "server_cmd": None if args.no_server else args.server_cmd,
+        "url": args.url,
+        "corpus": args.corpus,
+        "concurrency": args.concurrency,
+        "rate": args.rate,
+        "timeout": args.timeout,
+        "warmup": args.warmup,
+    }
+    save_results(summary, settings, latencies, statuses, args.tag, base_name)
+
+
+if __name__ == "__main__":
+    main()
@@ -5,13 +5,17 @@ Spyder Editor
 This is a temporary script file.
 """
 
-from flask import Flask, render_template, request
+import os
+
+from flask import Flask, abort, jsonify, render_template, request
 
 # Create the application object
 from ComplaintsAnalysis.Predictor import Predictor
 
 app = Flask(__name__)
 app.config['SEND_FILE_MAX_AGE_DEFAULT'] = 0
+# Debug endpoints expose internals, only enable them with DEBUG_ENDPOINTS=1
+app.config['DEBUG_ENDPOINTS'] = os.environ.get('DEBUG_ENDPOINTS') == '1'
 
 # prepare the model
 predictor = Predictor()
@@ -52,6 +56,21 @@ def predict():
                               will_escalate= will_escalate,
                               user_input="NotEmpty")
 
+@app.route('/debug/memory')
+def debug_memory():
+    """
+    Report the memory of the loaded models and caches.
+    With user_input given, also trace allocations of a prediction on it.
+    """
+    if not app.config['DEBUG_ENDPOINTS']:
+        abort(404)
+
+    report = predictor.memory_report()
+    narrative = request.args.get('user_input')
+    if narrative:
+        report["traces"] = predictor.trace_prediction(narrative, max(1, request.args.get('top_n', 10, type=int)))
+    return jsonify(report)
+
 
 # start the server with the 'run()' method
 if __name__ == "__main__":